@@ -22,6 +22,10 @@ with srlock.SR830(resource=res, timeout=10000) as lia:
     # Config
     run = 15
     timeConst = 3  # in seconds
+    nHarm = 0  # > 0 also records X,Y at harmonics 1..nHarm
+
+    # Harmonic-resolved X,Y per point (NaN above the detection limit)
+    harm = np.full((len(freqRange), len(voltRange), nHarm, 2), np.nan)
 
     lia.oflt(timeConst)
 
@@ -48,6 +52,9 @@ with srlock.SR830(resource=res, timeout=10000) as lia:
             n = np.std(runData, axis=0)
             data[i, j] = m
             noise[i, j] = n
+            if nHarm > 0:
+                harm[i, j] = lia.harmonic_scan(nHarm)
 
 # Save data
-np.savez("data.npz", freqRange=freqRange, voltRange=voltRange, data=data, noise=noise)
+extra = {"harm": harm} if nHarm > 0 else {}
+np.savez("data.npz", freqRange=freqRange, voltRange=voltRange, data=data, noise=noise, **extra)
@@ -0,0 +1,415 @@
+"""
+noisepyramid.py - Multi-resolution storage for long lock-in noise records
+
+Requires: numpy (matplotlib for plot(), srlock for acquire())
+Notes:
+ - A NoisePyramid is a directory holding the raw samples (level 0) plus a
+   decimation pyramid. Each bin at level k summarises factor**k raw samples
+   by its min, max, mean and M2 (sum of squared deviations, so var = M2/n),
+   for every channel.
+ - append() writes the raw chunk and updates every level incrementally. Only
+   the unfinished bins (< factor entries per level) are kept in memory, so
+   arbitrarily long records can be captured with bounded memory.
+ - view() and stats() read levels through np.memmap. view() picks the
+   coarsest level that still gives max_points bins over the window, for
+   plotting min/max envelopes. stats() gives exact min/max/mean/var over any
+   window by combining whole coarse bins in the interior with finer bins at
+   the edges.
+ - The record may consist of several segments of uniformly spaced samples
+   (e.g. one per SR830 buffer fill). mark_gap() stores where each segment
+   starts in time, and all times (t0/t1 arguments, view() bin times) are
+   seconds since the first sample, with the gaps taken into account.
+ - Reopening an existing directory continues the record where it stopped.
+"""
+
+import json
+import os
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Record fields stored per bin and channel at levels >= 1
+FIELDS = ("min", "max", "mean", "m2")
+
+# SR830 data buffer length (points per channel)
+BUFFER_SIZE = 16383
+
+
+def _to_records(samples: np.ndarray) -> np.ndarray:
+    "Raw samples (n, nch) -> single-sample records (n, nch, 4)."
+    x = samples.astype(np.float64)
+    return np.stack([x, x, x, np.zeros_like(x)], axis=-1)
+
+
+def _merge(records: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """
+    Combine records along axis 0 into one record per channel. counts holds
+    the number of raw samples behind each record.
+    """
+    counts = np.asarray(counts, dtype=np.float64)[:, None]
+    n = counts.sum()
+    mean = (records[..., 2] * counts).sum(axis=0) / n
+    m2 = records[..., 3].sum(axis=0) + (counts * (records[..., 2] - mean) ** 2).sum(axis=0)
+    return np.stack(
+        [records[..., 0].min(axis=0), records[..., 1].max(axis=0), mean, m2], axis=-1
+    )
+
+
+def _decimate(records: np.ndarray, factor: int, count: int) -> np.ndarray:
+    """
+    Combine consecutive groups of factor records, each summarising count
+    raw samples, into one record per group. len(records) must be a multiple
+    of factor.
+    """
+    nch = records.shape[1]
+    g = records.reshape(-1, factor, nch, 4)
+    mean = g[..., 2].mean(axis=1)
+    m2 = g[..., 3].sum(axis=1) + count * ((g[..., 2] - mean[:, None]) ** 2).sum(axis=1)
+    return np.stack([g[..., 0].min(axis=1), g[..., 1].max(axis=1), mean, m2], axis=-1)
+
+
+class NoisePyramid:
+    """
+    Decimation pyramid stored in directory path.
+    - channels: channel names, e.g. ("X", "Y")
+    - dt: sample interval in seconds (1 / SRAT sample rate)
+    - factor: decimation factor between levels
+    - dtype: storage type of the raw samples
+    channels/dt/factor/dtype are only used when creating a new record;
+    an existing directory is reopened with its stored settings.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        channels: Sequence[str] = ("X", "Y"),
+        dt: float = 1.0,
+        factor: int = 8,
+        dtype: str = "float32",
+    ):
+        self.path = path
+        meta_path = os.path.join(path, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as fh:
+                meta = json.load(fh)
+        else:
+            if int(factor) < 2:
+                raise ValueError("factor must be >= 2")
+            os.makedirs(path, exist_ok=True)
+            meta = {
+                "channels": list(channels),
+                "dt": float(dt),
+                "factor": int(factor),
+                "dtype": str(np.dtype(dtype)),
+                "t0": time.time(),
+                "segments": [[0, 0.0]],
+            }
+        self._meta_path = meta_path
+        self.meta = meta
+        self.meta.setdefault("segments", [[0, 0.0]])
+        self._save_meta()
+        self.channels: List[str] = meta["channels"]
+        self.dt: float = meta["dt"]
+        self.factor: int = meta["factor"]
+        self.dtype = np.dtype(meta["dtype"])
+        self.nch = len(self.channels)
+
+        # entries per level and the unfinished tail of each level below the top
+        self._lengths = [self._file_len(0)]
+        k = 1
+        while os.path.exists(self._level_path(k)):
+            self._lengths.append(self._file_len(k))
+            k += 1
+        self._pending: List[np.ndarray] = []
+        for k in range(len(self._lengths)):
+            done = self._lengths[k + 1] * self.factor if k + 1 < len(self._lengths) else 0
+            self._pending.append(self._read(k, done, self._lengths[k]))
+
+    # Storage helpers
+    def _save_meta(self):
+        with open(self._meta_path, "w") as fh:
+            json.dump(self.meta, fh, indent=2)
+
+    def _level_path(self, k: int) -> str:
+        return os.path.join(self.path, f"level{k}.bin")
+
+    def _entry_size(self, k: int) -> int:
+        if k == 0:
+            return self.nch * self.dtype.itemsize
+        return self.nch * len(FIELDS) * 8
+
+    def _file_len(self, k: int) -> int:
+        p = self._level_path(k)
+        return os.path.getsize(p) // self._entry_size(k) if os.path.exists(p) else 0
+
+    def _read(self, k: int, start: int, stop: int) -> np.ndarray:
+        "Entries start..stop of level k as records (n, nch, 4)."
+        start, stop = max(int(start), 0), min(int(stop), self._lengths[k])
+        if stop <= start:
+            return np.empty((0, self.nch, 4))
+        if k == 0:
+            mm = np.memmap(self._level_path(0), dtype=self.dtype, mode="r",
+                           shape=(self._lengths[0], self.nch))
+            return _to_records(np.asarray(mm[start:stop]))
+        mm = np.memmap(self._level_path(k), dtype=np.float64, mode="r",
+                       shape=(self._lengths[k], self.nch, len(FIELDS)))
+        return np.array(mm[start:stop])
+
+    def _write(self, k: int, data: np.ndarray):
+        with open(self._level_path(k), "ab") as fh:
+            fh.write(np.ascontiguousarray(data).tobytes())
+        self._lengths[k] += len(data)
+
+    def __len__(self) -> int:
+        "Number of raw samples stored."
+        return self._lengths[0]
+
+    @property
+    def levels(self) -> int:
+        return len(self._lengths)
+
+    @property
+    def t0(self) -> float:
+        "Host time (time.time()) of the first sample."
+        return self.meta["t0"]
+
+    # Time axis
+    def mark_gap(self, t: Optional[float] = None):
+        """
+        Start a new segment: the next appended sample was taken at host time
+        t (default now). The first call on an empty record sets t0.
+        """
+        t = time.time() if t is None else float(t)
+        segs = self.meta["segments"]
+        if len(self) == 0:
+            self.meta["t0"] = t
+            segs[:] = [[0, 0.0]]
+        else:
+            # never let host clock jitter put the segment before its samples
+            rel = max(t - self.t0, float(self.time_of(len(self))))
+            if segs[-1][0] == len(self):
+                segs[-1][1] = rel
+            else:
+                segs.append([len(self), rel])
+        self._save_meta()
+
+    def time_of(self, index) -> np.ndarray:
+        "Seconds since the first sample for raw sample index (or indices)."
+        segs = np.asarray(self.meta["segments"], dtype=np.float64)
+        idx = np.asarray(index, dtype=np.float64)
+        k = np.searchsorted(segs[:, 0], idx, side="right") - 1
+        return segs[k, 1] + (idx - segs[k, 0]) * self.dt
+
+    def index_of(self, t: float) -> int:
+        """
+        First raw sample taken at or after t seconds since the first sample
+        (a time inside a gap maps to the start of the next segment).
+        """
+        segs = self.meta["segments"]
+        times = [s[1] for s in segs]
+        k = max(int(np.searchsorted(times, t, side="right")) - 1, 0)
+        idx = segs[k][0] + int(np.ceil((t - segs[k][1]) / self.dt - 1e-9))
+        if k + 1 < len(segs):
+            idx = min(idx, segs[k + 1][0])
+        return idx
+
+    # Writing
+    def append(self, samples: np.ndarray):
+        """
+        Append raw samples, shape (n, nch) (or (n,) for one channel), and
+        update the pyramid. Cost is O(n) regardless of the record length.
+        """
+        samples = np.asarray(samples, dtype=self.dtype).reshape(-1, self.nch)
+        if len(samples) == 0:
+            return
+        self._write(0, samples)
+        new = _to_records(samples)
+        k = 0
+        while len(new):
+            buf = np.concatenate([self._pending[k], new])
+            full = len(buf) - len(buf) % self.factor
+            self._pending[k] = buf[full:]
+            if full == 0:
+                break
+            new = _decimate(buf[:full], self.factor, self.factor**k)
+            k += 1
+            if k == len(self._lengths):
+                self._lengths.append(0)
+                self._pending.append(np.empty((0, self.nch, 4)))
+            self._write(k, new)
+
+    # Reading
+    def level_for(self, n_samples: int, max_points: int) -> int:
+        "Coarsest level that still gives at least max_points bins over n_samples."
+        k = 0
+        while k + 1 < self.levels and n_samples // self.factor ** (k + 1) >= max_points:
+            k += 1
+        return k
+
+    def _window(self, t0: Optional[float], t1: Optional[float]):
+        "Time window [t0, t1) in seconds since the first sample -> raw sample range."
+        a = 0 if t0 is None else self.index_of(t0)
+        b = len(self) if t1 is None else self.index_of(t1)
+        return max(a, 0), min(b, len(self))
+
+    def view(
+        self, t0: Optional[float] = None, t1: Optional[float] = None, max_points: int = 2000
+    ) -> Dict[str, np.ndarray]:
+        """
+        Decimated data for the window [t0, t1) in seconds, read from a single
+        level with roughly max_points..factor*max_points bins. Samples at the
+        end that are not yet folded into that level are summarised into one
+        extra, shorter bin from the finer levels. Returns t (bin start times),
+        count (samples per bin), min, max, mean, std (each (nbins, nch)) and
+        level. A bin that spans a gap between segments is still one bin.
+        """
+        a, b = self._window(t0, t1)
+        k = self.level_for(b - a, max_points)
+        size = self.factor**k
+        first = a // size
+        rec = self._read(k, first, -(-b // size))
+        starts = (np.arange(len(rec)) + first) * size
+        counts = np.full(len(rec), size, dtype=np.int64)
+        tail = (first + len(rec)) * size
+        if tail < b:
+            rec = np.concatenate([rec, self._summary(tail, b)[None]])
+            starts = np.append(starts, tail)
+            counts = np.append(counts, b - tail)
+        return {
+            "t": self.time_of(starts),
+            "count": counts,
+            "min": rec[..., 0],
+            "max": rec[..., 1],
+            "mean": rec[..., 2],
+            "std": np.sqrt(rec[..., 3] / counts[:, None]),
+            "level": k,
+        }
+
+    def _cover(self, a: int, b: int, k: int, parts: List[np.ndarray], counts: List[int]):
+        "Collect records covering raw samples [a, b) using levels <= k."
+        size = self.factor**k
+        lo = -(-a // size)
+        hi = min(b // size, self._lengths[k])
+        if k == 0 or hi <= lo:
+            if k == 0:
+                parts.append(self._read(0, a, b))
+                counts.extend([1] * (b - a))
+            else:
+                self._cover(a, b, k - 1, parts, counts)
+            return
+        parts.append(self._read(k, lo, hi))
+        counts.extend([size] * (hi - lo))
+        if a < lo * size:
+            self._cover(a, lo * size, k - 1, parts, counts)
+        if hi * size < b:
+            self._cover(hi * size, b, k - 1, parts, counts)
+
+    def _summary(self, a: int, b: int) -> np.ndarray:
+        "One record (nch, 4) summarising raw samples [a, b)."
+        parts: List[np.ndarray] = []
+        counts: List[int] = []
+        self._cover(a, b, self.levels - 1, parts, counts)
+        return _merge(np.concatenate(parts), np.array(counts))
+
+    def stats(
+        self, t0: Optional[float] = None, t1: Optional[float] = None
+    ) -> Dict[str, np.ndarray]:
+        """
+        Exact statistics over the window [t0, t1) in seconds. Returns count
+        and per-channel min, max, mean and var (population variance). Reads
+        only O(factor * levels) bins.
+        """
+        a, b = self._window(t0, t1)
+        if b <= a:
+            raise ValueError("Empty time window.")
+        rec = self._summary(a, b)
+        return {
+            "count": b - a,
+            "min": rec[:, 0],
+            "max": rec[:, 1],
+            "mean": rec[:, 2],
+            "var": rec[:, 3] / (b - a),
+        }
+
+    def plot(
+        self,
+        ax,
+        channel: str = "X",
+        t0: Optional[float] = None,
+        t1: Optional[float] = None,
+        max_points: int = 2000,
+        **kwargs,
+    ):
+        "Plot the min/max envelope and mean of channel over [t0, t1) on ax."
+        c = self.channels.index(channel)
+        v = self.view(t0, t1, max_points)
+        ax.fill_between(v["t"], v["min"][:, c], v["max"][:, c], alpha=0.3, step="post", **kwargs)
+        ax.plot(v["t"], v["mean"][:, c], drawstyle="steps-post", **kwargs)
+        ax.set_xlabel("Time [s]")
+        ax.set_ylabel(f"{channel} [V]")
+        return v
+
+
+def acquire(
+    lia, pyramid: NoisePyramid, duration_s: float, poll_s: float = 1.0, margin_s: float = 1.0
+):
+    """
+    Stream the SR830 data buffer (CH1, CH2 via TRCB?) into pyramid for
+    duration_s seconds. The displays and SRAT must already be set (e.g.
+    DDEF 1,0,0 / DDEF 2,1,0 for X and Y) and pyramid.dt must match SRAT.
+    The buffer runs in 1-shot mode and is paused, read out and restarted
+    margin_s before it would fill. Each restart is recorded with
+    pyramid.mark_gap() at the STRT time, so the short dead time of the
+    restart (a few command round trips) does not shift later timestamps.
+    """
+    import srlock
+
+    srat = lia.srat()
+    if not 0 <= srat < len(srlock.SAMPLE_RATES):
+        raise ValueError("acquire() needs an internal sample rate (SRAT 0..13)")
+    rate = srlock.SAMPLE_RATES[srat]
+    if not np.isclose(pyramid.dt * rate, 1.0):
+        raise ValueError(f"pyramid.dt={pyramid.dt} does not match SRAT rate {rate} Hz")
+    limit = max(BUFFER_SIZE - int(margin_s * rate), 1)
+
+    def read_new(read):
+        n = lia.spts()
+        if n > read:
+            x = lia.trcb(1, read, n - read)
+            y = lia.trcb(2, read, n - read)
+            pyramid.append(np.column_stack([x, y]))
+        return max(n, read)
+
+    lia.send_mode(0)
+    end = time.time() + duration_s
+    try:
+        while time.time() < end:
+            lia.rest()
+            lia.strt()
+            pyramid.mark_gap()
+            seg_end = min(end, time.time() + limit / rate)
+            read = 0
+            while time.time() < seg_end:
+                time.sleep(max(min(poll_s, seg_end - time.time()), 0.0))
+                read = read_new(read)
+            lia.paus()
+            read_new(read)
+    finally:
+        lia.paus()
+
+
+# Example usage
+if __name__ == "__main__":
+    import matplotlib.pyplot as plt
+
+    # one hour of synthetic X/Y noise at 512 Hz, appended in buffer-sized chunks
+    rng = np.random.default_rng(0)
+    pyr = NoisePyramid("noise_pyramid_demo", dt=1 / 512.0)
+    while len(pyr) < 3600 * 512:
+        pyr.append(1e-8 * rng.standard_normal((BUFFER_SIZE, 2)))
+    print("Samples:", len(pyr), "levels:", pyr.levels)
+    print("Stats 100 s..2000 s:", pyr.stats(100.0, 2000.0))
+    fig, ax = plt.subplots(figsize=(10, 4))
+    pyr.plot(ax, "X", 0.0, 3600.0)
+    plt.show()
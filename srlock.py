@@ -1,7 +1,7 @@
 """
 srlock.py - A Python wrapper for the Stanford Research SR830 lock-in
 
-Requires: pyvisa
+Requires: pyvisa, numpy
 Notes:
  - This implements a high-coverage set of commands described in the SR830
    manual. It also exposes a low-level send/query API so you can call any
@@ -16,19 +16,121 @@ Notes:
    and value = mantissa * 2**(exp - 124).
 """
 
+import json
+import math
 import time
 import struct
-from typing import Optional, Sequence, Tuple, List, Union
+from typing import Dict, Optional, Sequence, Tuple, List, Union
 
+import numpy as np
 import pyvisa as visa  # pip install pyvisa
 
 # If using the NI backend, environment must be set up (NI-VISA).
 
+# OFLT index -> time constant in seconds (10 us .. 30 ks, manual table)
+TIME_CONSTANTS = [
+    10e-6, 30e-6, 100e-6, 300e-6,
+    1e-3, 3e-3, 10e-3, 30e-3, 100e-3, 300e-3,
+    1.0, 3.0, 10.0, 30.0, 100.0, 300.0,
+    1e3, 3e3, 10e3, 30e3,
+]
+
+# OFSL index (6, 12, 18, 24 dB/oct) -> time constants to settle within 99%
+SETTLE_TAUS = [5.0, 7.0, 9.0, 10.0]
+
+# SRAT index 0..13 -> buffer sample rate in Hz (62.5 mHz .. 512 Hz); 14 = trigger
+SAMPLE_RATES = [62.5e-3 * 2**i for i in range(14)]
+
+# Upper limit on harmonic * reference frequency for the detection channel
+MAX_DETECTION_FREQ = 102_000.0
+
+# Scalar parameters making up a setup profile, in the order they are applied
+# (reference source before frequency, gain settings last).
+PROFILE_PARAMS = [
+    ("FMOD", int), ("FREQ", float), ("RSLP", int), ("HARM", int),
+    ("PHAS", float), ("SLVL", float),
+    ("ISRC", int), ("IGND", int), ("ICPL", int), ("ILIN", int),
+    ("OFLT", int), ("OFSL", int), ("SYNC", int),
+    ("SRAT", int), ("SEND", int), ("TSTR", int),
+    ("RMOD", int), ("SENS", int),
+]
+_PROFILE_TYPES = dict(PROFILE_PARAMS)
+
+
+def _profile_value(m: str, v) -> Union[int, float]:
+    """
+    Convert a profile parameter to the value the instrument actually holds:
+    PHAS has 0.01 deg resolution, SLVL 2 mV, FREQ 5 digits or 0.1 mHz.
+    """
+    v = _PROFILE_TYPES[m](v)
+    if m == "PHAS":
+        v = round(v, 2)
+    elif m == "SLVL":
+        v = round(round(v / 0.002) * 0.002, 3)
+    elif m == "FREQ" and v > 0:
+        v = round(v, min(4, 4 - int(math.floor(math.log10(v)))))
+    return v
+
+
+def normalise_profile(values: Dict[str, Union[int, float]]) -> Dict[str, Union[int, float]]:
+    "Validate profile keys (KeyError if unknown) and normalise the values."
+    unknown = [m for m in values if m not in _PROFILE_TYPES]
+    if unknown:
+        raise KeyError(f"Unknown profile parameters {unknown}; expected {list(_PROFILE_TYPES)}")
+    return {m: _profile_value(m, v) for m, v in values.items()}
+
+# Commands that change profile parameters as a side effect
+_INVALIDATES = {"AGAN": ("SENS",), "ARSV": ("RMOD",), "APHS": ("PHAS",)}
+
+
+def _settable(values: Dict[str, Union[int, float]]) -> Dict[str, Union[int, float]]:
+    """
+    Drop FREQ when values select the external reference (FMOD 0): FREQ? then
+    reads the measured frequency and the FREQ command is not allowed.
+    """
+    if values.get("FMOD") == 0:
+        return {m: v for m, v in values.items() if m != "FREQ"}
+    return values
+
+
+def settle_time(oflt: int, ofsl: int) -> float:
+    """
+    Time in seconds for the output filter to settle to 99% of a step, given
+    the OFLT time constant index and OFSL slope index.
+    """
+    return TIME_CONSTANTS[int(oflt)] * SETTLE_TAUS[int(ofsl)]
+
 
 class SR830Error(Exception):
     pass
 
 
+class DeadlineExceeded(Exception):
+    "A deadline-aware operation stopped because it would overrun its deadline."
+
+
+def _parse_floats(raw: bytes, count: int, as_list: bool = False) -> Union[np.ndarray, List[float]]:
+    """
+    Parse a comma separated ASCII response (trailing comma and terminator
+    allowed, as TRCA? sends them) into a float array in one C-level pass,
+    or into a list when as_list is True. Raises SR830Error if the response is
+    malformed or does not hold exactly count values (e.g. after a desync).
+    """
+    body = raw.rstrip(b"\r\n ,")
+    try:
+        if as_list:
+            vals = [float(p) for p in body.split(b",") if p.strip()] if body else []
+            n = len(vals)
+        else:
+            vals = np.fromstring(body, sep=",")
+            n = vals.size
+    except ValueError as e:
+        raise SR830Error(f"Malformed response {raw[:40]!r}: {e}")
+    if n != count:
+        raise SR830Error(f"Expected {count} values, got {n}: {raw[:40]!r}")
+    return vals
+
+
 class SR830:
     """
     High-level driver for SR830 via GPIB (pyvisa).
@@ -71,7 +173,35 @@ class SR830:
         self.inst.read_termination = "\n"
         self.inst.write_termination = "\n"
 
+        # Host-side cache of profile parameters last written to / read from
+        # the instrument. Missing keys mean "unknown" and are always sent.
+        self._state: Dict[str, Union[int, float]] = {}
+        # Named setup profiles and the SSET/RSET slots they are saved in
+        self.profiles: Dict[str, Dict[str, Union[int, float]]] = {}
+        self.profile_slots: Dict[str, int] = {}
+
     # Low-level helpers
+    def _track(self, cmd: str):
+        """
+        Update the cached profile state from a command line that was just
+        written. Setting commands record their value; commands that change
+        the setup wholesale (or as a side effect) drop the affected entries.
+        """
+        for part in cmd.split(";"):
+            head, _, arg = part.strip().partition(" ")
+            head = head.upper()
+            if head in ("*RST", "RSET"):
+                self._state.clear()
+            elif head in _INVALIDATES:
+                for m in _INVALIDATES[head]:
+                    self._state.pop(m, None)
+            elif head in _PROFILE_TYPES and arg and "," not in arg:
+                try:
+                    self._state[head] = _profile_value(head, arg)
+                except ValueError:
+                    self._state.pop(head, None)
+        self._state = _settable(self._state)
+
     def _serial_poll_status(self) -> int:
         """
         Read the Serial Poll Status Byte (STB). This uses VISA's read_stb() which
@@ -107,6 +237,7 @@ class SR830:
         """
         # allow passing many commands separated by semicolons as manual says
         self.inst.write(cmd)
+        self._track(cmd)
         if wait_for_completion:
             self._wait_for_ifc_ready(timeout_s=timeout_s)
 
@@ -124,6 +255,63 @@ class SR830:
         resp = self.inst.read()
         return resp.strip()
 
+    def query_raw(self, cmd: str, timeout_s: float = 5.0) -> bytes:
+        """
+        Like query() but return the undecoded response bytes (terminator
+        included), for callers that parse the payload themselves.
+        """
+        self.inst.write(cmd)
+        self._wait_for_ifc_ready(timeout_s=timeout_s)
+        return self.inst.read_raw()
+
+    def query_float(self, cmd: str, timeout_s: float = 5.0) -> float:
+        "query() a single numeric value; SR830Error if the reply is not a number."
+        resp = self.query(cmd, timeout_s=timeout_s)
+        try:
+            return float(resp)
+        except ValueError:
+            raise SR830Error(f"Malformed response to {cmd}: {resp!r}")
+
+    def query_int(self, cmd: str, timeout_s: float = 5.0) -> int:
+        "query() a single integer value; SR830Error if the reply is not one."
+        resp = self.query(cmd, timeout_s=timeout_s)
+        try:
+            return int(resp)
+        except ValueError:
+            raise SR830Error(f"Malformed response to {cmd}: {resp!r}")
+
+    def query_many(self, cmds: Sequence[str], timeout_s: float = 5.0) -> List[str]:
+        """
+        Send several queries on one line separated by semicolons and return
+        their responses in order. The SR830 returns each answer with its own
+        terminator, so this costs a single write for the whole batch.
+        """
+        self.inst.write(";".join(cmds))
+        self._wait_for_ifc_ready(timeout_s=timeout_s)
+        return [self.inst.read().strip() for _ in cmds]
+
+    def resync(self, drain_timeout_ms: int = 100):
+        """
+        Recover after a timeout: device clear, *CLS, then discard any pending
+        response bytes so the next query reads its own answer. The cached
+        profile state is dropped since a command may have half-completed.
+        """
+        try:
+            self.inst.clear()
+        except Exception:
+            pass
+        self.send("*CLS", wait_for_completion=False)
+        self._state.clear()
+        timeout = self.inst.timeout
+        self.inst.timeout = drain_timeout_ms
+        try:
+            while True:
+                self.inst.read_raw()
+        except visa.errors.VisaIOError:
+            pass
+        finally:
+            self.inst.timeout = timeout
+
     def read_raw(
         self, num_bytes: Optional[int] = None, timeout_s: float = 5.0
     ) -> bytes:
@@ -169,8 +357,7 @@ class SR830:
     def phas(self, x: Optional[float] = None) -> Optional[float]:
         "PHAS {x} set phase shift; PHAS? query. Returns new phase on query."
         if x is None:
-            resp = self.query("PHAS?")
-            return float(resp)
+            return self.query_float("PHAS?")
         else:
             self.send(f"PHAS {float(x):.2f}")
             return None
@@ -178,7 +365,7 @@ class SR830:
     def fmod(self, i: Optional[int] = None) -> Optional[int]:
         "FMOD {i} set/query reference source (1 internal, 0 external)."
         if i is None:
-            return int(self.query("FMOD?"))
+            return self.query_int("FMOD?")
         else:
             self.send(f"FMOD {int(i)}")
             return None
@@ -186,7 +373,7 @@ class SR830:
     def freq(self, f: Optional[float] = None) -> Optional[float]:
         "FREQ {f} set internal reference frequency (when internal). Query with FREQ?."
         if f is None:
-            return float(self.query("FREQ?"))
+            return self.query_float("FREQ?")
         else:
             self.send(f"FREQ {float(f)}")
             return None
@@ -194,7 +381,7 @@ class SR830:
     def rslp(self, i: Optional[int] = None) -> Optional[int]:
         "RSLP {i} reference trigger selection when external reference (0 sine zero crossing, 1 TTL rising, 2 TTL falling)."
         if i is None:
-            return int(self.query("RSLP?"))
+            return self.query_int("RSLP?")
         else:
             self.send(f"RSLP {int(i)}")
             return None
@@ -202,15 +389,61 @@ class SR830:
     def harm(self, i: Optional[int] = None) -> Optional[int]:
         "HARM {i} set/query detection harmonic (1..19999)."
         if i is None:
-            return int(self.query("HARM?"))
+            return self.query_int("HARM?")
         else:
             self.send(f"HARM {int(i)}")
             return None
 
+    def harmonic_scan(
+        self,
+        n_harm: int,
+        params: Sequence[int] = (1, 2),
+        settle_s: Optional[float] = None,
+        deadline: Optional[float] = None,
+    ) -> np.ndarray:
+        """
+        Step HARM through 1..n_harm at the current reference frequency and SNAP
+        params at each harmonic. Returns an array of shape (n_harm, len(params)),
+        row k-1 holding harmonic k (default params are X, Y).
+        The reference does not change, so only the output filter has to settle
+        between harmonics. settle_s defaults to settle_time(OFLT?, OFSL?).
+        Harmonics above MAX_DETECTION_FREQ are left as NaN. The original HARM
+        setting is restored afterwards. If deadline (a time.time() value) is
+        given, DeadlineExceeded is raised instead of settling past it.
+        """
+        if n_harm < 1:
+            raise ValueError("n_harm must be >= 1")
+        if settle_s is None:
+            oflt = self._state.get("OFLT")
+            ofsl = self._state.get("OFSL")
+            settle_s = settle_time(
+                self.oflt() if oflt is None else oflt,
+                self.ofsl() if ofsl is None else ofsl,
+            )
+        f = self.freq()
+        original = self.harm()
+        out = np.full((int(n_harm), len(params)), np.nan)
+        try:
+            current = original
+            for k in range(1, int(n_harm) + 1):
+                if k * f > MAX_DETECTION_FREQ:
+                    break
+                if k != current:
+                    if deadline is not None and time.time() + settle_s > deadline:
+                        raise DeadlineExceeded("Harmonic scan would run past its deadline.")
+                    current = k
+                    self.harm(k)
+                    time.sleep(settle_s)
+                out[k - 1] = self.snap(params)
+        finally:
+            if current != original:
+                self.harm(original)
+        return out
+
     def slvl(self, x: Optional[float] = None) -> Optional[float]:
         "SLVL {x} set/query sine output amplitude in V (0.004 .. 5.0)."
         if x is None:
-            return float(self.query("SLVL?"))
+            return self.query_float("SLVL?")
         else:
             self.send(f"SLVL {float(x)}")
             return None
@@ -219,7 +452,7 @@ class SR830:
     def isrc(self, i: Optional[int] = None) -> Optional[int]:
         "ISRC {i} input configuration: A=0, A-B=1, I(1M)=2, I(100M)=3"
         if i is None:
-            return int(self.query("ISRC?"))
+            return self.query_int("ISRC?")
         else:
             self.send(f"ISRC {int(i)}")
             return None
@@ -227,7 +460,7 @@ class SR830:
     def ignd(self, i: Optional[int] = None) -> Optional[int]:
         "IGND {i} input shield grounding: Float=0, Ground=1"
         if i is None:
-            return int(self.query("IGND?"))
+            return self.query_int("IGND?")
         else:
             self.send(f"IGND {int(i)}")
             return None
@@ -235,7 +468,7 @@ class SR830:
     def icpl(self, i: Optional[int] = None) -> Optional[int]:
         "ICPL {i} input coupling: AC=0, DC=1"
         if i is None:
-            return int(self.query("ICPL?"))
+            return self.query_int("ICPL?")
         else:
             self.send(f"ICPL {int(i)}")
             return None
@@ -243,7 +476,7 @@ class SR830:
     def ilin(self, i: Optional[int] = None) -> Optional[int]:
         "ILIN {i} input line notch filter status. i=0..3"
         if i is None:
-            return int(self.query("ILIN?"))
+            return self.query_int("ILIN?")
         else:
             self.send(f"ILIN {int(i)}")
             return None
@@ -252,7 +485,7 @@ class SR830:
     def sens(self, i: Optional[int] = None) -> Optional[int]:
         "SENS {i} set/query sensitivity index (see manual table)."
         if i is None:
-            return int(self.query("SENS?"))
+            return self.query_int("SENS?")
         else:
             self.send(f"SENS {int(i)}")
             return None
@@ -260,7 +493,7 @@ class SR830:
     def rmod(self, i: Optional[int] = None) -> Optional[int]:
         "RMOD {i} reserve mode: 0 High Reserve, 1 Normal, 2 Low Noise"
         if i is None:
-            return int(self.query("RMOD?"))
+            return self.query_int("RMOD?")
         else:
             self.send(f"RMOD {int(i)}")
             return None
@@ -268,7 +501,7 @@ class SR830:
     def oflt(self, i: Optional[int] = None) -> Optional[int]:
         "OFLT {i} time constant selection (index 0..19 mapping in manual)."
         if i is None:
-            return int(self.query("OFLT?"))
+            return self.query_int("OFLT?")
         else:
             self.send(f"OFLT {int(i)}")
             return None
@@ -276,7 +509,7 @@ class SR830:
     def ofsl(self, i: Optional[int] = None) -> Optional[int]:
         "OFSL {i} filter slope: 0..3 (6,12,18,24 dB/oct)"
         if i is None:
-            return int(self.query("OFSL?"))
+            return self.query_int("OFSL?")
         else:
             self.send(f"OFSL {int(i)}")
             return None
@@ -284,7 +517,7 @@ class SR830:
     def sync(self, i: Optional[int] = None) -> Optional[int]:
         "SYNC {i} synchronous filter: 0 off, 1 on (<200Hz detection frequency)."
         if i is None:
-            return int(self.query("SYNC?"))
+            return self.query_int("SYNC?")
         else:
             self.send(f"SYNC {int(i)}")
             return None
@@ -303,12 +536,15 @@ class SR830:
     def ddef_query(self, i: int) -> Tuple[int, int]:
         resp = self.query(f"DDEF? {int(i)}")
         parts = resp.split(",")
-        return (int(parts[0]), int(parts[1]) if len(parts) > 1 else 0)
+        try:
+            return (int(parts[0]), int(parts[1]) if len(parts) > 1 else 0)
+        except ValueError as e:
+            raise SR830Error(f"Malformed response {resp!r}: {e}")
 
     def fpop(self, i: int, j: Optional[int] = None) -> Optional[int]:
         "FPOP i, j sets front panel output source; FPOP? i queries j."
         if j is None:
-            return int(self.query(f"FPOP? {int(i)}"))
+            return self.query_int(f"FPOP? {int(i)}")
         else:
             self.send(f"FPOP {int(i)},{int(j)}")
             return None
@@ -320,8 +556,11 @@ class SR830:
         """
         if x is None and j is None:
             resp = self.query(f"OEXP? {int(i)}")
-            off, ex = resp.split(",")
-            return float(off), int(ex)
+            try:
+                off, ex = resp.split(",")
+                return float(off), int(ex)
+            except ValueError as e:
+                raise SR830Error(f"Malformed response {resp!r}: {e}")
         if x is None or j is None:
             raise ValueError("Both x and j are required to set OEXP")
         self.send(f"OEXP {int(i)},{float(x):.2f},{int(j)}")
@@ -333,13 +572,12 @@ class SR830:
     # Aux input/output
     def oaux(self, i: int) -> float:
         "OAUX? i query Aux Input i (1..4) - returns volts as float."
-        resp = self.query(f"OAUX? {int(i)}")
-        return float(resp)
+        return self.query_float(f"OAUX? {int(i)}")
 
     def auxv(self, i: int, x: Optional[float] = None) -> Optional[float]:
         "AUXV i,x set/query Aux Output i (1..4) to x volts (-10.5..10.5)."
         if x is None:
-            return float(self.query(f"AUXV? {int(i)}"))
+            return self.query_float(f"AUXV? {int(i)}")
         else:
             self.send(f"AUXV {int(i)},{float(x)}")
             return None
@@ -348,7 +586,7 @@ class SR830:
     def ovrm(self, i: Optional[int] = None) -> Optional[int]:
         "OVRM {i} set/query override remote (0 no, 1 yes)"
         if i is None:
-            return int(self.query("OVRM?"))
+            return self.query_int("OVRM?")
         else:
             self.send(f"OVRM {int(i)}")
             return None
@@ -356,7 +594,7 @@ class SR830:
     def kclk(self, i: Optional[int] = None) -> Optional[int]:
         "KCLK {i} key click On(1)/Off(0)"
         if i is None:
-            return int(self.query("KCLK?"))
+            return self.query_int("KCLK?")
         else:
             self.send(f"KCLK {int(i)}")
             return None
@@ -364,7 +602,7 @@ class SR830:
     def alrm(self, i: Optional[int] = None) -> Optional[int]:
         "ALRM {i} alarm On(1)/Off(0)"
         if i is None:
-            return int(self.query("ALRM?"))
+            return self.query_int("ALRM?")
         else:
             self.send(f"ALRM {int(i)}")
             return None
@@ -377,6 +615,87 @@ class SR830:
         "RSET i - recall setup buffer i (1..9)"
         self.send(f"RSET {int(i)}")
 
+    # Setup profiles (host-side snapshots, optionally bound to SSET/RSET slots)
+    def capture_profile(self, name: Optional[str] = None) -> Dict[str, Union[int, float]]:
+        """
+        Read every PROFILE_PARAMS value in one batched query, refresh the
+        cached state and return the values as a dict. If name is given the
+        snapshot is also stored in self.profiles[name]. With the external
+        reference (FMOD 0) FREQ is left out, since it is measured, not set.
+        """
+        resp = self.query_many([f"{m}?" for m, _ in PROFILE_PARAMS])
+        try:
+            profile = {m: _profile_value(m, r) for (m, _), r in zip(PROFILE_PARAMS, resp)}
+        except ValueError as e:
+            raise SR830Error(f"Malformed response {resp!r}: {e}")
+        profile = _settable(profile)
+        self._state.pop("FREQ", None)
+        self._state.update(profile)
+        if name is not None:
+            self.profiles[name] = dict(profile)
+        return profile
+
+    def apply_profile(self, profile: Union[str, Dict[str, Union[int, float]]]) -> int:
+        """
+        Bring the instrument to a profile (a name in self.profiles or a dict of
+        PROFILE_PARAMS values). Only parameters that differ from the cached
+        state are sent, all on one command line. If a named profile is bound
+        to a setup slot and more than one parameter differs, a single RSET is
+        issued instead. Returns the number of commands sent. Raises KeyError
+        for keys that are not PROFILE_PARAMS mnemonics (upper case). FREQ is
+        skipped when the profile (or, if it has no FMOD, the cached state)
+        selects the external reference.
+        The cache only knows about changes made through this object; call
+        capture_profile() after touching the front panel.
+        """
+        name = profile if isinstance(profile, str) else None
+        values = normalise_profile(self.profiles[name] if name is not None else profile)
+        if self._state.get("FMOD") == 0 and "FMOD" not in values:
+            values.pop("FREQ", None)
+        values = _settable(values)
+        diff = [
+            (m, values[m])
+            for m, _ in PROFILE_PARAMS
+            if m in values and self._state.get(m) != values[m]
+        ]
+        if not diff:
+            return 0
+        slot = self.profile_slots.get(name) if name is not None else None
+        if slot is not None and len(diff) > 1:
+            self.rset(slot)
+            self._state.update(values)
+            return 1
+        self.send(";".join(f"{m} {v}" for m, v in diff))
+        return len(diff)
+
+    def save_profile_slot(self, name: str, slot: int):
+        """
+        Apply profile name, save the resulting setup with SSET into slot (1..9)
+        and bind the profile to it so apply_profile can recall it with RSET.
+        The instrument state is read back first, so front panel changes made
+        since the last capture cannot end up in the slot.
+        """
+        if not 1 <= int(slot) <= 9:
+            raise ValueError("Setup slot must be in 1..9")
+        self.profile_slots.pop(name, None)
+        self.capture_profile()
+        self.apply_profile(name)
+        self.sset(slot)
+        self.profile_slots[name] = int(slot)
+
+    def save_profiles(self, path: str):
+        "Write self.profiles and their slot bindings to a JSON file."
+        with open(path, "w") as fh:
+            json.dump({"profiles": self.profiles, "slots": self.profile_slots}, fh, indent=2)
+
+    def load_profiles(self, path: str):
+        "Load profiles and slot bindings written by save_profiles()."
+        with open(path) as fh:
+            blob = json.load(fh)
+        for name, values in blob.get("profiles", {}).items():
+            self.profiles[name] = normalise_profile(values)
+        self.profile_slots.update({k: int(v) for k, v in blob.get("slots", {}).items()})
+
     # Auto functions
     def agan(self):
         "AGAN - Auto Gain"
@@ -394,7 +713,7 @@ class SR830:
     def srat(self, i: Optional[int] = None) -> Optional[int]:
         "SRAT {i} set/query sample rate (0..13 or 14=Trigger)"
         if i is None:
-            return int(self.query("SRAT?"))
+            return self.query_int("SRAT?")
         else:
             self.send(f"SRAT {int(i)}")
             return None
@@ -402,7 +721,7 @@ class SR830:
     def send_mode(self, i: Optional[int] = None) -> Optional[int]:
         "SEND {i} set/query end-of-buffer mode: 0=1Shot,1=Loop"
         if i is None:
-            return int(self.query("SEND?"))
+            return self.query_int("SEND?")
         else:
             self.send(f"SEND {int(i)}")
             return None
@@ -410,7 +729,7 @@ class SR830:
     def tstr(self, i: Optional[int] = None) -> Optional[int]:
         "TSTR {i} set/query trigger start mode (1 trigger starts scan)"
         if i is None:
-            return int(self.query("TSTR?"))
+            return self.query_int("TSTR?")
         else:
             self.send(f"TSTR {int(i)}")
             return None
@@ -433,43 +752,50 @@ class SR830:
         OUTP? i - read value of X(1), Y(2), R(3), theta(4)
         Returns float (volts or degrees)
         """
-        return float(self.query(f"OUTP? {int(i)}"))
+        return self.query_float(f"OUTP? {int(i)}")
 
     def outr(self, i: int) -> float:
         """
         OUTR? i - read value of CH1 or CH2 display (i=1 or 2)
         """
-        return float(self.query(f"OUTR? {int(i)}"))
+        return self.query_float(f"OUTR? {int(i)}")
 
-    def snap(self, params: Sequence[int]) -> List[float]:
+    def snap(
+        self, params: Sequence[int], as_list: bool = False
+    ) -> Union[np.ndarray, List[float]]:
         """
         SNAP? i,j,{k...} - collect 2..6 parameters at same instant.
         Parameter mapping is described in the manual.
-        Returns list of floats in same order requested.
+        Returns an array of floats in same order requested; as_list=True
+        returns a plain list as older callers expect. Raises SR830Error if
+        the reply does not hold one value per parameter.
         """
         if not (2 <= len(params) <= 6):
             raise ValueError("SNAP? requires between 2 and 6 parameters.")
         param_str = ",".join(str(int(p)) for p in params)
-        resp = self.query(f"SNAP? {param_str}")
-        parts = resp.split(",")
-        return [float(p) for p in parts if p != ""]
+        return _parse_floats(self.query_raw(f"SNAP? {param_str}"), len(params), as_list)
 
     def spts(self) -> int:
         "SPTS? - return number of points stored in data buffer."
-        return int(self.query("SPTS?"))
+        return self.query_int("SPTS?")
 
-    def trca(self, channel: int, start_bin: int, count: int) -> List[float]:
+    def trca(
+        self,
+        channel: int,
+        start_bin: int,
+        count: int,
+        as_list: bool = False,
+    ) -> Union[np.ndarray, List[float]]:
         """
         TRCA? i, j, k - returns ASCII floating point values separated by commas.
         channel: 1 or 2
         start_bin: j (>=0)
         count: k (>=1)
+        The response is parsed in bulk into an array; as_list=True returns a
+        plain list. Raises SR830Error unless exactly count values arrive.
         """
         cmd = f"TRCA? {int(channel)},{int(start_bin)},{int(count)}"
-        resp = self.query(cmd)
-        # response is comma separated, trailing comma may be present per manual
-        parts = [p for p in resp.split(",") if p.strip() != ""]
-        return [float(p) for p in parts]
+        return _parse_floats(self.query_raw(cmd), int(count), as_list)
 
     def trcb(self, channel: int, start_bin: int, count: int) -> List[float]:
         """
@@ -514,7 +840,7 @@ class SR830:
     def fast(self, i: Optional[int] = None):
         "FAST {i} set/query fast data transfer. i=0 off,1 fast1,2 fast2"
         if i is None:
-            return int(self.query("FAST?"))
+            return self.query_int("FAST?")
         else:
             self.send(f"FAST {int(i)}")
 
@@ -530,65 +856,65 @@ class SR830:
     def ese(self, i: Optional[int] = None):
         "ESE {i} set/query standard event enable register (0..255)"
         if i is None:
-            return int(self.query("*ESE?"))
+            return self.query_int("*ESE?")
         else:
             self.send(f"*ESE {int(i)}")
 
     def esr(self, i: Optional[int] = None) -> Optional[int]:
         "ESR? query standard event status byte (read clears it)."
         if i is None:
-            return int(self.query("*ESR?"))
+            return self.query_int("*ESR?")
         else:
-            return int(self.query(f"*ESR? {int(i)}"))
+            return self.query_int(f"*ESR? {int(i)}")
 
     def sre(self, i: Optional[int] = None):
         "SRE {i} set/query serial poll enable register"
         if i is None:
-            return int(self.query("*SRE?"))
+            return self.query_int("*SRE?")
         else:
             self.send(f"*SRE {int(i)}")
 
     def stb(self, i: Optional[int] = None):
         "STB? query serial poll status byte (read-only, doesn't clear bits)."
         if i is None:
-            return int(self.query("*STB?"))
+            return self.query_int("*STB?")
         else:
-            return int(self.query(f"*STB? {int(i)}"))
+            return self.query_int(f"*STB? {int(i)}")
 
     def psc(self, i: Optional[int] = None):
         "PSC {i} set value of power-on status clear bit"
         if i is None:
-            return int(self.query("*PSC?"))
+            return self.query_int("*PSC?")
         else:
             self.send(f"*PSC {int(i)}")
 
     def erre(self, i: Optional[int] = None):
         "ERRE {i} set/query error status enable register"
         if i is None:
-            return int(self.query("ERRE?"))
+            return self.query_int("ERRE?")
         else:
             self.send(f"ERRE {int(i)}")
 
     def errs(self, i: Optional[int] = None):
         "ERRS? query error status byte"
         if i is None:
-            return int(self.query("ERRS?"))
+            return self.query_int("ERRS?")
         else:
-            return int(self.query(f"ERRS? {int(i)}"))
+            return self.query_int(f"ERRS? {int(i)}")
 
     def liae(self, i: Optional[int] = None):
         "LIAE {i} set/query LIA (lock-in) status enable register"
         if i is None:
-            return int(self.query("LIAE?"))
+            return self.query_int("LIAE?")
         else:
             self.send(f"LIAE {int(i)}")
 
     def lias(self, i: Optional[int] = None):
         "LIAS? query LIA status byte (read clears it)"
         if i is None:
-            return int(self.query("LIAS?"))
+            return self.query_int("LIAS?")
         else:
-            return int(self.query(f"LIAS? {int(i)}"))
+            return self.query_int(f"LIAS? {int(i)}")
 
     def close(self):
         "Close the VISA session."
@@ -624,6 +950,13 @@ if __name__ == "__main__":
         # Example snapshot of X and Y and frequency:
         snap_vals = lia.snap([1, 2, 9])  # X, Y, RefFreq
         print("SNAP X,Y,f:", snap_vals)
+        # Example: capture the current setup once, recall it cheaply later
+        lia.capture_profile("sweep")
+        lia.save_profiles("profiles.json")
+        lia.apply_profile("sweep")  # no-op: nothing differs from the cache
+        # Example: X,Y at harmonics 1..5 without re-settling the reference
+        harm_xy = lia.harmonic_scan(5)
+        print("Harmonic X,Y:", harm_xy)
         # Example: read CH1 ASCII buffer points
         n = lia.spts()
         print("Points stored:", n)
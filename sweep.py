@@ -0,0 +1,272 @@
+"""
+sweep.py - Fault-tolerant frequency/voltage sweeps on an SR830
+
+Requires: numpy, pyvisa, srlock
+Notes:
+ - A sweep is described by a SweepSpec (frequency and voltage grids, number
+   of SNAP? polls per point, settling and poll delays) and executed by a
+   SweepRunner against an open srlock.SR830.
+ - Every instrument command is retried with exponential backoff. After a
+   timeout the instrument is re-synchronised (device clear, *CLS, drain the
+   input buffer) before the next attempt.
+ - A point that still fails, or that runs over its time budget, is marked
+   FAILED in the status array (its data stays NaN) and the sweep carries on.
+   Failed points are revisited once the main pass is done.
+ - Results are saved with the same freqRange/voltRange/data/noise keys as
+   the existing data/*.npz files, plus a status array.
+"""
+
+import logging
+import time
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pyvisa as visa
+
+import srlock
+
+log = logging.getLogger(__name__)
+
+# Point status codes stored in SweepResult.status
+PENDING = 0
+OK = 1
+FAILED = -1
+
+# Errors worth retrying: IFC RDY timeouts and garbled replies (SR830Error) and
+# VISA I/O errors (read timeouts). Anything else, e.g. a ValueError from a bad
+# argument, is a programming or configuration error and is raised as is.
+RETRYABLE = (srlock.SR830Error, visa.errors.VisaIOError)
+
+
+class PointFailed(Exception):
+    pass
+
+
+class SweepSpec:
+    """
+    Description of a 2D sweep: every (freq, volt) pair is a point.
+    - freqs, volts: reference frequencies (Hz) and sine amplitudes (V)
+    - run: number of SNAP? polls averaged per point
+    - settle_s: wait after setting the point before polling
+    - poll_s: wait between polls
+    - params: SNAP? parameters to record (default X, Y, R, theta)
+    - n_harm: if > 0, also record X,Y at harmonics 1..n_harm per point
+    Raises ValueError if params does not hold 2..6 entries or run < 1.
+    """
+
+    def __init__(
+        self,
+        freqs: Sequence[float],
+        volts: Sequence[float],
+        run: int = 15,
+        settle_s: float = 3.0,
+        poll_s: float = 0.5,
+        params: Sequence[int] = (1, 2, 3, 4),
+        n_harm: int = 0,
+    ):
+        self.freqs = [float(f) for f in freqs]
+        self.volts = [float(v) for v in volts]
+        self.run = int(run)
+        self.settle_s = float(settle_s)
+        self.poll_s = float(poll_s)
+        self.params = tuple(int(p) for p in params)
+        self.n_harm = int(n_harm)
+        if not 2 <= len(self.params) <= 6:
+            raise ValueError("SNAP? requires between 2 and 6 parameters.")
+        if self.run < 1:
+            raise ValueError("run must be >= 1")
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return (len(self.freqs), len(self.volts))
+
+    def points(self) -> List[Tuple[int, int]]:
+        "All (i, j) grid indices in acquisition order (frequency outer)."
+        return [(i, j) for i in range(len(self.freqs)) for j in range(len(self.volts))]
+
+
+class SweepResult:
+    """
+    Arrays filled in by SweepRunner. data/noise hold the per-point mean and
+    standard deviation of the SNAP? parameters (NaN until measured), status
+    holds PENDING/OK/FAILED, attempts counts tries per point and harm holds
+    harmonic-resolved X,Y when spec.n_harm > 0.
+    """
+
+    def __init__(self, spec: SweepSpec):
+        nf, nv = spec.shape
+        npar = len(spec.params)
+        self.spec = spec
+        self.data = np.full((nf, nv, npar), np.nan)
+        self.noise = np.full((nf, nv, npar), np.nan)
+        self.status = np.full((nf, nv), PENDING, dtype=np.int8)
+        self.attempts = np.zeros((nf, nv), dtype=np.int32)
+        self.harm = np.full((nf, nv, max(spec.n_harm, 0), 2), np.nan)
+
+    def failed(self) -> List[Tuple[int, int]]:
+        "Grid indices of points currently marked FAILED."
+        return [tuple(int(k) for k in ij) for ij in np.argwhere(self.status == FAILED)]
+
+    def save(self, path: str, **extra):
+        """
+        Save in the same layout as the existing data/*.npz files. Keyword
+        arguments are stored as additional arrays.
+        """
+        if self.spec.n_harm > 0:
+            extra["harm"] = self.harm
+        np.savez(
+            path,
+            freqRange=self.spec.freqs,
+            voltRange=self.spec.volts,
+            data=self.data,
+            noise=self.noise,
+            status=self.status,
+            **extra,
+        )
+
+
+class SweepRunner:
+    """
+    Execute a SweepSpec on an open SR830.
+    - retries: extra attempts per command after the first one fails
+    - backoff_s: delay before the first retry, doubled on every further retry
+    - point_budget_s: wall time allowed per point (None = unlimited); a point
+      over budget is abandoned and marked FAILED
+    - revisits: number of extra passes over failed points after the sweep
+    - on_point: optional callback(i, j, result) after each point finishes
+    """
+
+    def __init__(
+        self,
+        lia: srlock.SR830,
+        spec: SweepSpec,
+        retries: int = 3,
+        backoff_s: float = 0.5,
+        point_budget_s: Optional[float] = None,
+        revisits: int = 1,
+        on_point: Optional[Callable[[int, int, SweepResult], None]] = None,
+    ):
+        self.lia = lia
+        self.spec = spec
+        self.retries = int(retries)
+        self.backoff_s = float(backoff_s)
+        self.point_budget_s = point_budget_s
+        self.revisits = int(revisits)
+        self.on_point = on_point
+        self.result = SweepResult(spec)
+        self._deadline: Optional[float] = None
+
+    def _check_budget(self):
+        if self._deadline is not None and time.time() > self._deadline:
+            raise PointFailed("Point exceeded its time budget.")
+
+    def _sleep(self, seconds: float):
+        "Sleep, but never past the current point's deadline."
+        if self._deadline is not None:
+            seconds = min(seconds, max(self._deadline - time.time(), 0.0))
+        time.sleep(seconds)
+        self._check_budget()
+
+    def call(self, fn: Callable, *args, **kwargs):
+        """
+        Run one instrument command, retrying RETRYABLE errors with
+        exponential backoff and a resync in between. Raises PointFailed once
+        the retries or the point budget are used up, or straight away if fn
+        reports that it would overrun the budget (srlock.DeadlineExceeded).
+        """
+        for attempt in range(self.retries + 1):
+            self._check_budget()
+            try:
+                return fn(*args, **kwargs)
+            except srlock.DeadlineExceeded as e:
+                raise PointFailed(str(e))
+            except RETRYABLE as e:
+                err = e
+            try:
+                self.lia.resync()
+            except RETRYABLE:
+                pass
+            if attempt < self.retries:
+                self._sleep(self.backoff_s * 2**attempt)
+        raise PointFailed(f"{err} (after {self.retries + 1} attempts)")
+
+    def measure_point(self, i: int, j: int):
+        "Set up grid point (i, j), poll it and store the statistics."
+        spec, res = self.spec, self.result
+        self.call(self.lia.slvl, spec.volts[j])
+        self.call(self.lia.freq, spec.freqs[i])
+        self._sleep(spec.settle_s)
+        runData = np.full((spec.run, len(spec.params)), np.nan)
+        for o in range(spec.run):
+            runData[o] = self.call(self.lia.snap, spec.params)
+            if o + 1 < spec.run:
+                self._sleep(spec.poll_s)
+        if spec.n_harm > 0:
+            res.harm[i, j] = self.call(
+                self.lia.harmonic_scan, spec.n_harm, deadline=self._deadline
+            )
+        res.data[i, j] = np.mean(runData, axis=0)
+        res.noise[i, j] = np.std(runData, axis=0)
+
+    def run_point(self, i: int, j: int) -> int:
+        """
+        Measure grid point (i, j) within the point budget, record the outcome
+        in self.result and return its status (OK or FAILED).
+        """
+        res = self.result
+        res.attempts[i, j] += 1
+        if self.point_budget_s is not None:
+            self._deadline = time.time() + self.point_budget_s
+        try:
+            self.measure_point(i, j)
+            res.status[i, j] = OK
+        except PointFailed as e:
+            res.data[i, j] = np.nan
+            res.noise[i, j] = np.nan
+            res.harm[i, j] = np.nan
+            res.status[i, j] = FAILED
+            log.warning("Point f=%g V=%g failed: %s", self.spec.freqs[i], self.spec.volts[j], e)
+        finally:
+            self._deadline = None
+        if self.on_point is not None:
+            self.on_point(i, j, res)
+        return int(res.status[i, j])
+
+    def run(self) -> SweepResult:
+        """
+        Measure every pending point, then revisit failed ones up to
+        self.revisits times. Returns the SweepResult (also kept in
+        self.result, so partial data survives a KeyboardInterrupt).
+        """
+        for i, j in self.spec.points():
+            if self.result.status[i, j] == PENDING:
+                self.run_point(i, j)
+        for _ in range(self.revisits):
+            failed = self.result.failed()
+            if not failed:
+                break
+            for i, j in failed:
+                self.run_point(i, j)
+        return self.result
+
+
+# Example usage
+if __name__ == "__main__":
+    res = "GPIB0::8::INSTR"
+    spec = SweepSpec(
+        freqs=list(range(20_000, 100_000, 2000)) + [100_000],
+        volts=[1e-2],
+        run=15,
+        settle_s=3.0,
+        poll_s=0.5,
+    )
+    with srlock.SR830(resource=res, timeout=10000) as lia:
+        lia.outx(1)
+        lia.fmod(1)
+        lia.oflt(8)
+        runner = SweepRunner(lia, spec, point_budget_s=60.0)
+        try:
+            result = runner.run()
+        finally:
+            runner.result.save(f"data_{time.time():.0f}.npz")
+    print("Failed points:", runner.result.failed())
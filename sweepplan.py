@@ -0,0 +1,279 @@
+"""
+sweepplan.py - Offline planning of SR830 sweeps (run time and expected noise)
+
+Requires: numpy, srlock, sweep
+Notes:
+ - estimate_duration() adds up, per grid point, the GPIB command costs
+   (SLVL, FREQ, run x SNAP?, optional harmonic scan) and the settling and
+   polling delays of a sweep.SweepSpec. Command costs default to typical
+   GPIB round-trip times; measure_command_costs() times them on a real
+   instrument so the estimate can be recalibrated.
+ - The expected noise is simulated. Gaussian white noise is passed through
+   the output filter (OFLT time constant, OFSL number of poles) and sampled
+   `run` times at the poll interval (or the SRAT buffer sample rate; this
+   only affects the simulation, not the run time estimate). This gives the
+   spread of a single reading and of the averaged point, relative to the
+   filter output noise. The result is scaled per point by the input
+   noise density times sqrt(ENBW).
+ - The filtered process does not depend on the reference frequency, so
+   each (oflt, ofsl, sample interval, run) setting is simulated once.
+   compare() runs several candidate plans in a process pool so that grids
+   and time constants can be compared side by side.
+"""
+
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+import srlock
+from sweep import SweepSpec
+
+# OFSL index -> equivalent noise bandwidth in units of 1/tau
+ENBW_FACTORS = [1.0 / 4.0, 1.0 / 8.0, 3.0 / 32.0, 5.0 / 64.0]
+
+SAMPLE_RATES = srlock.SAMPLE_RATES
+
+# Typical GPIB round-trip times in seconds (override with measured values)
+COMMAND_COSTS = {"send": 0.010, "query": 0.015, "snap": 0.020}
+
+# SR830 input voltage noise, V/sqrt(Hz)
+INPUT_NOISE = 6e-9
+
+
+def sample_interval(spec: SweepSpec, srat: Optional[int] = None) -> float:
+    """
+    Spacing in seconds between the run samples of one point: the spec's
+    poll interval, or the buffer sample period when srat (0..13) is given.
+    """
+    if srat is None:
+        return spec.poll_s
+    if not 0 <= int(srat) < len(SAMPLE_RATES):
+        raise ValueError("srat must be a sample rate index 0..13 to plan with")
+    return 1.0 / SAMPLE_RATES[int(srat)]
+
+
+def measure_command_costs(lia: srlock.SR830, n: int = 20) -> Dict[str, float]:
+    """
+    Time n repetitions of a setting command, a query and a 4-parameter SNAP?
+    on a connected instrument. Returns a dict shaped like COMMAND_COSTS.
+    """
+    freq = lia.freq()
+    t0 = time.perf_counter()
+    for _ in range(n):
+        lia.freq(freq)
+    t1 = time.perf_counter()
+    for _ in range(n):
+        lia.freq()
+    t2 = time.perf_counter()
+    for _ in range(n):
+        lia.snap([1, 2, 3, 4])
+    t3 = time.perf_counter()
+    return {"send": (t1 - t0) / n, "query": (t2 - t1) / n, "snap": (t3 - t2) / n}
+
+
+def estimate_duration(
+    spec: SweepSpec,
+    oflt: int,
+    ofsl: int,
+    costs: Optional[Dict[str, float]] = None,
+    filter_cached: bool = False,
+) -> Dict[str, float]:
+    """
+    Estimate the wall time of running spec with sweep.SweepRunner, which
+    polls SNAP? every spec.poll_s. Returns point_s (mean seconds per grid
+    point), total_s, and settle_min_s (the 99% filter settling time for
+    oflt/ofsl). settle_ok is False if spec.settle_s is shorter than
+    settle_min_s; settled_total_s is the run time with the settling delay
+    raised to settle_min_s in that case. filter_cached=True assumes the
+    driver already knows OFLT/OFSL, so harmonic scans skip those queries.
+    """
+    c = dict(COMMAND_COSTS, **(costs or {}))
+    settle_min = srlock.settle_time(oflt, ofsl)
+    point = 2 * c["send"] + spec.settle_s
+    point += spec.run * c["snap"] + (spec.run - 1) * spec.poll_s
+    nf, nv = spec.shape
+    points = np.full(nf, point)
+    if spec.n_harm > 0:
+        # harmonic_scan skips harmonics above the detection limit
+        f = np.asarray(spec.freqs, dtype=float)
+        n = np.minimum(spec.n_harm, np.floor(srlock.MAX_DETECTION_FREQ / f))
+        # FREQ?, HARM? (and OFLT?, OFSL?), SNAP? per harmonic, then
+        # HARM k + settle for k >= 2 and a HARM restore
+        points += (2 if filter_cached else 4) * c["query"] + n * c["snap"]
+        points += np.maximum(n - 1, 0) * (c["send"] + settle_min)
+        points += np.where(n > 1, c["send"], 0.0)
+    extra_settle = max(settle_min - spec.settle_s, 0.0)
+    total = float(points.sum()) * nv
+    return {
+        "point_s": total / (nf * nv) if nf * nv else 0.0,
+        "total_s": total,
+        "settled_total_s": total + extra_settle * nf * nv,
+        "settle_min_s": settle_min,
+        "settle_ok": spec.settle_s >= settle_min,
+    }
+
+
+def noise_density(
+    freqs: Sequence[float], white: float = INPUT_NOISE, corner_hz: float = 0.0
+) -> np.ndarray:
+    """
+    Input noise density in V/sqrt(Hz) at each frequency: a white floor with
+    a 1/f contribution that equals it at corner_hz.
+    """
+    f = np.asarray(freqs, dtype=float)
+    return white * np.sqrt(1.0 + corner_hz / f)
+
+
+def _reg_lower_gamma(n: int, x: float) -> float:
+    "Regularised lower incomplete gamma P(n, x) for integer n >= 1."
+    terms = [x**k / math.factorial(k) for k in range(n)]
+    if x > 1.0:
+        return 1.0 - math.exp(-x) * sum(terms)
+    # small x: sum the tail of the exponential series to avoid cancellation
+    total, term, k = 0.0, x**n / math.factorial(n), n
+    while term > 1e-17 * total or k == n:
+        total += term
+        k += 1
+        term *= x / k
+    return math.exp(-x) * total
+
+
+def _filter_model(tau: float, poles: int, dt: float):
+    """
+    Exact discretisation of a cascade of `poles` identical RC stages (time
+    constant tau) driven by unit white noise and sampled every dt. Returns
+    (F, Q, P): state transition over dt, covariance of the noise added per
+    step, and the stationary covariance of the stage outputs.
+    """
+    r = dt / tau
+    F = np.zeros((poles, poles))
+    for i in range(poles):
+        for j in range(i + 1):
+            F[i, j] = math.exp(-r) * r ** (i - j) / math.factorial(i - j)
+    P = np.empty((poles, poles))
+    Q = np.empty((poles, poles))
+    for i in range(poles):
+        for j in range(poles):
+            m = i + j
+            c = tau * math.factorial(m) / (
+                math.factorial(i) * math.factorial(j) * 2.0 ** (m + 1)
+            )
+            P[i, j] = c
+            Q[i, j] = c * _reg_lower_gamma(m + 1, 2.0 * r)
+    return F, Q, P
+
+
+def _psd_sqrt(m: np.ndarray) -> np.ndarray:
+    "Matrix S with S @ S.T == m for a (possibly singular) covariance m."
+    w, v = np.linalg.eigh(m)
+    return v * np.sqrt(np.clip(w, 0.0, None))
+
+
+def _filtered_samples(
+    oflt: int, ofsl: int, dt: float, run: int, trials: int, rng: np.random.Generator
+) -> np.ndarray:
+    """
+    Simulate `trials` independent runs of `run` samples spaced dt apart at
+    the output of an (ofsl + 1)-pole RC filter driven by white noise.
+    Returns an array of shape (trials, run) in units of the stationary output
+    standard deviation. The filter starts in its stationary state and is
+    advanced one sample interval per step, so the cost does not depend on
+    the time constant.
+    """
+    tau = srlock.TIME_CONSTANTS[int(oflt)]
+    poles = int(ofsl) + 1
+    F, Q, P = _filter_model(tau, poles, dt)
+    step_noise = _psd_sqrt(Q)
+    state = rng.standard_normal((trials, poles)) @ _psd_sqrt(P).T
+    out = np.empty((trials, run))
+    for k in range(run):
+        if k > 0:
+            state = state @ F.T + rng.standard_normal((trials, poles)) @ step_noise.T
+        out[:, k] = state[:, -1]
+    return out / math.sqrt(P[-1, -1])
+
+
+def plan(
+    spec: SweepSpec,
+    oflt: int,
+    ofsl: int,
+    srat: Optional[int] = None,
+    costs: Optional[Dict[str, float]] = None,
+    filter_cached: bool = False,
+    white: float = INPUT_NOISE,
+    corner_hz: float = 0.0,
+    trials: int = 2000,
+    seed: int = 0,
+) -> Dict[str, object]:
+    """
+    Estimate run time and per-point noise for spec at the given settings.
+    srat only changes the sample spacing used in the noise simulation; the
+    run time is always that of SweepRunner polling at spec.poll_s.
+    Returns the estimate_duration() fields plus:
+    - sigma: (nf, nv) expected standard deviation of a single X reading
+    - sigma_mean: (nf, nv) expected standard deviation of the averaged point
+    - noise_sim: (nf, nv) one simulated draw of the std that SweepRunner
+      would record for each point (spread of a finite run)
+    """
+    rng = np.random.default_rng(seed)
+    dt = sample_interval(spec, srat)
+    run = max(spec.run, 1)
+    samples = _filtered_samples(oflt, ofsl, dt, run, trials, rng)
+    mean_ratio = samples.mean(axis=1).std()
+    std_draws = samples.std(axis=1)
+
+    tau = srlock.TIME_CONSTANTS[int(oflt)]
+    enbw = ENBW_FACTORS[int(ofsl)] / tau
+    nf, nv = spec.shape
+    sigma_f = noise_density(spec.freqs, white, corner_hz) * np.sqrt(enbw)
+    sigma = np.repeat(sigma_f[:, None], nv, axis=1)
+    noise_sim = sigma * rng.choice(std_draws, size=(nf, nv))
+
+    result = estimate_duration(spec, oflt, ofsl, costs, filter_cached)
+    result.update(
+        {
+            "oflt": int(oflt),
+            "ofsl": int(ofsl),
+            "srat": srat,
+            "sigma": sigma,
+            "sigma_mean": sigma * mean_ratio,
+            "noise_sim": noise_sim,
+        }
+    )
+    return result
+
+
+def _plan_kwargs(kwargs: Dict[str, object]) -> Dict[str, object]:
+    return plan(**kwargs)
+
+
+def compare(configs: List[Dict[str, object]], processes: Optional[int] = None):
+    """
+    Run plan(**config) for every config dict in a process pool and return
+    the results in the same order. Each config needs at least spec, oflt
+    and ofsl.
+    """
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(_plan_kwargs, configs))
+
+
+# Example usage
+if __name__ == "__main__":
+    # The 2probeDataCol.py grid at three time constants
+    spec = SweepSpec(
+        freqs=range(5, 100000, 50),
+        volts=[i / 10 for i in range(0, 100)],
+        run=15,
+        settle_s=6.0,
+        poll_s=3.0,
+    )
+    configs = [{"spec": spec, "oflt": oflt, "ofsl": 1} for oflt in (8, 10, 11)]
+    for r in compare(configs):
+        print(
+            f"OFLT {r['oflt']}: {r['total_s'] / 3600:.1f} h"
+            f" ({r['settled_total_s'] / 3600:.1f} h fully settled),"
+            f" median sigma_mean: {np.median(r['sigma_mean']):.3e} V"
+        )
@@ -0,0 +1,289 @@
+"""
+sweepshard.py - Run one sweep across several SR830 stations in parallel
+
+Requires: numpy, pyvisa, srlock, sweep
+Notes:
+ - Each Station (VISA resource plus calibration metadata) is driven by its
+   own worker process, which opens the instrument, optionally applies a
+   common setup profile (srlock.SR830.apply_profile) and measures points
+   with a sweep.SweepRunner.
+ - The coordinator hands each worker its next grid point as soon as the
+   previous one is done, so a slow station simply takes fewer points and the
+   remaining work rebalances as the sweep runs.
+ - If a worker process dies, cannot open its instrument, or fails too many
+   points in a row, it is marked down. The point it was measuring goes back
+   on the queue for the remaining stations.
+ - Failed points are requeued up to `revisits` times (any station may pick
+   them up). The coordinator merges everything into a single ShardedResult
+   that records which station measured each point and every station's
+   metadata.
+"""
+
+import inspect
+import json
+import logging
+import multiprocessing as mp
+import queue
+import time
+from collections import deque
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+import srlock
+from sweep import FAILED, OK, SweepResult, SweepRunner, SweepSpec
+
+log = logging.getLogger(__name__)
+
+
+class Station:
+    """
+    One lock-in bench.
+    - resource: VISA resource string, e.g. 'GPIB0::8::INSTR'
+    - name: label used in the merged dataset (defaults to resource)
+    - calibration: free-form calibration metadata (gain/phase corrections,
+      cable lengths, date of last calibration, ...) saved with the results
+    - timeout: VISA communication timeout in milliseconds
+    """
+
+    def __init__(
+        self,
+        resource: str,
+        name: Optional[str] = None,
+        calibration: Optional[Dict[str, object]] = None,
+        timeout: int = 10000,
+    ):
+        self.resource = resource
+        self.name = name or resource
+        self.calibration = dict(calibration or {})
+        self.timeout = int(timeout)
+
+    def metadata(self, lia: srlock.SR830) -> Dict[str, object]:
+        "Station description plus the instrument's IDN and current setup."
+        return {
+            "name": self.name,
+            "resource": self.resource,
+            "calibration": self.calibration,
+            "idn": lia.idn(),
+            "profile": lia.capture_profile(),
+        }
+
+
+class ShardedResult(SweepResult):
+    """
+    SweepResult merged from several stations. station holds, per point, the
+    index into stations (metadata dicts) of the station that measured it,
+    or -1 if nobody did.
+    """
+
+    def __init__(self, spec: SweepSpec, stations: Sequence[Station]):
+        super().__init__(spec)
+        self.station = np.full(spec.shape, -1, dtype=np.int16)
+        self.stations: List[Dict[str, object]] = [
+            {"name": s.name, "resource": s.resource, "calibration": s.calibration}
+            for s in stations
+        ]
+
+    def save(self, path: str, **extra):
+        "Save like SweepResult.save plus the station map and metadata (JSON)."
+        super().save(path, station=self.station, stations=json.dumps(self.stations), **extra)
+
+
+def _station_worker(wid, station, spec, profile, max_fails, runner_kwargs, tasks, results):
+    """
+    Worker process body: open the station, report ("up", metadata), then
+    measure points from tasks until a None sentinel arrives, reporting
+    ("done", ...) after every point and ("down", reason) if it gives up.
+    """
+    try:
+        lia = srlock.SR830(resource=station.resource, timeout=station.timeout)
+    except Exception as e:
+        results.put((wid, "down", f"open failed: {e}"))
+        return
+    with lia:
+        try:
+            if profile is not None:
+                lia.apply_profile(profile)
+            runner = SweepRunner(lia, spec, revisits=0, **runner_kwargs)
+            results.put((wid, "up", station.metadata(lia)))
+        except Exception as e:
+            results.put((wid, "down", f"setup failed: {e!r}"))
+            return
+        res = runner.result
+        fails = 0
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            i, j = task
+            status = runner.run_point(i, j)
+            results.put(
+                (wid, "done", (i, j, status, res.data[i, j], res.noise[i, j], res.harm[i, j]))
+            )
+            fails = fails + 1 if status == FAILED else 0
+            if fails >= max_fails:
+                results.put((wid, "down", f"{fails} consecutive failed points"))
+                return
+
+
+class SweepCoordinator:
+    """
+    Split one SweepSpec across several Stations.
+    - profile: setup profile dict (see srlock.PROFILE_PARAMS) applied on every
+      station before measuring, so all benches run the same settings
+    - revisits: how many times a failed point is requeued
+    - max_consecutive_failures: a station that fails this many points in a
+      row is taken out of the sweep
+    - runner_kwargs: passed to each station's SweepRunner (retries,
+      backoff_s, point_budget_s); other names raise TypeError
+    """
+
+    def __init__(
+        self,
+        stations: Sequence[Station],
+        spec: SweepSpec,
+        profile: Optional[Dict[str, object]] = None,
+        revisits: int = 1,
+        max_consecutive_failures: int = 5,
+        **runner_kwargs,
+    ):
+        if not stations:
+            raise ValueError("At least one station is required.")
+        self.stations = list(stations)
+        self.spec = spec
+        # validate up front rather than failing inside every worker
+        self.profile = None if profile is None else srlock.normalise_profile(profile)
+        self.revisits = int(revisits)
+        self.max_consecutive_failures = int(max_consecutive_failures)
+        allowed = set(inspect.signature(SweepRunner).parameters) - {"lia", "spec", "revisits"}
+        unknown = sorted(set(runner_kwargs) - allowed)
+        if unknown:
+            raise TypeError(f"Unknown SweepRunner arguments {unknown}; expected {sorted(allowed)}")
+        self.runner_kwargs = runner_kwargs
+        self.result = ShardedResult(spec, self.stations)
+
+    def _handle_done(self, wid, payload, pending, outstanding):
+        i, j, status, data, noise, harm = payload
+        if (i, j) not in outstanding:
+            # late result for a point already finished elsewhere
+            return
+        res = self.result
+        res.attempts[i, j] += 1
+        if status == OK:
+            res.data[i, j] = data
+            res.noise[i, j] = noise
+            if self.spec.n_harm > 0:
+                res.harm[i, j] = harm
+            res.status[i, j] = OK
+            res.station[i, j] = wid
+            outstanding.discard((i, j))
+        elif res.attempts[i, j] <= self.revisits:
+            pending.append((i, j))
+        else:
+            res.status[i, j] = FAILED
+            res.station[i, j] = wid
+            outstanding.discard((i, j))
+
+    def run(self, poll_s: float = 1.0) -> ShardedResult:
+        """
+        Start one worker per station, feed them every point and merge their
+        results until all points are finished or no station is left.
+        Points nobody could measure stay PENDING. Returns self.result.
+        """
+        ctx = mp.get_context()
+        results = ctx.Queue()
+        pending = deque(self.spec.points())
+        outstanding = set(pending)
+
+        workers, task_queues = {}, {}
+        for wid, station in enumerate(self.stations):
+            task_queues[wid] = ctx.Queue()
+            proc = ctx.Process(
+                target=_station_worker,
+                args=(
+                    wid, station, self.spec, self.profile, self.max_consecutive_failures,
+                    self.runner_kwargs, task_queues[wid], results,
+                ),
+                daemon=True,
+            )
+            proc.start()
+            workers[wid] = proc
+        live = set(workers)
+        ready = set()
+        inflight: Dict[int, tuple] = {}
+
+        def drop(wid, reason):
+            if wid not in live:
+                return
+            live.discard(wid)
+            ready.discard(wid)
+            self.result.stations[wid]["down"] = reason
+            log.warning("Station %s dropped out: %s", self.stations[wid].name, reason)
+            if wid in inflight:
+                pending.appendleft(inflight.pop(wid))
+
+        def handle(wid, kind, payload):
+            if kind == "up":
+                self.result.stations[wid].update(payload)
+                ready.add(wid)
+            elif kind == "done":
+                if wid in inflight:
+                    inflight.pop(wid)
+                elif (payload[0], payload[1]) in pending:
+                    # station was dropped and its point requeued
+                    pending.remove((payload[0], payload[1]))
+                self._handle_done(wid, payload, pending, outstanding)
+            elif kind == "down":
+                drop(wid, payload)
+
+        try:
+            while outstanding and live:
+                try:
+                    handle(*results.get(timeout=poll_s))
+                except queue.Empty:
+                    pass
+                for wid in list(live):
+                    if not workers[wid].is_alive():
+                        # a finished process has flushed its messages; read
+                        # them first so its own "down" reason wins
+                        try:
+                            while True:
+                                handle(*results.get_nowait())
+                        except queue.Empty:
+                            pass
+                        drop(wid, f"worker exited (code {workers[wid].exitcode})")
+                # hand the next point to every idle station
+                for wid in sorted(ready - set(inflight)):
+                    if not pending:
+                        break
+                    inflight[wid] = pending.popleft()
+                    task_queues[wid].put(inflight[wid])
+        finally:
+            for wid in workers:
+                task_queues[wid].put(None)
+            deadline = time.time() + 30.0
+            for proc in workers.values():
+                proc.join(timeout=max(deadline - time.time(), 0.1))
+                if proc.is_alive():
+                    proc.terminate()
+        return self.result
+
+
+# Example usage
+if __name__ == "__main__":
+    stations = [
+        Station("GPIB0::8::INSTR", name="bench-A"),
+        Station("GPIB1::8::INSTR", name="bench-B"),
+    ]
+    spec = SweepSpec(
+        freqs=range(5, 100000, 50),
+        volts=[i / 10 for i in range(0, 100)],
+        run=15,
+        settle_s=6.0,
+        poll_s=3.0,
+    )
+    profile = {"FMOD": 1, "OFLT": 10, "OFSL": 1}
+    coord = SweepCoordinator(stations, spec, profile=profile, point_budget_s=120.0)
+    result = coord.run()
+    result.save(f"data_{time.time():.0f}.npz")
+    print("Failed points:", result.failed())